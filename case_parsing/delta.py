@@ -68,7 +68,10 @@ class CaseDelta(StrictJsonObject):
         self.attachment.update(other.attachment)
         return self
 
+    def copy(self):
+        return self.__class__.wrap(self.to_json())
+
     def __add__(self, other):
-        result = self.__class__.wrap(self.to_json())
+        result = self.copy()
         result += other
         return result
@@ -15,4 +15,8 @@ class CloseCaseError(CaseArithmeticError):
 
 
 class CaseIdError(CaseArithmeticError):
-    pass
\ No newline at end of file
+    pass
+
+
+class CaseHistoryError(CaseParsingException):
+    pass
@@ -0,0 +1,136 @@
+import bisect
+
+from .delta import CaseDelta
+from .exceptions import CaseHistoryError, CaseIdError
+
+
+def _delta_size(delta):
+    return len(delta.update) + len(delta.index) + len(delta.attachment)
+
+
+class CaseHistory(object):
+    """
+    The ordered deltas of a single case, plus materialized checkpoints
+    of the folded case state.
+
+    A checkpoint is taken after the first delta, and then again once
+    `checkpoint_interval` deltas, or deltas carrying `checkpoint_size`
+    update/index/attachment items, have been added since the last one.
+    `state_at` then only has to fold forward from the nearest checkpoint.
+
+    """
+
+    def __init__(self, case_id, checkpoint_interval=50, checkpoint_size=None):
+        assert checkpoint_interval >= 1
+        assert checkpoint_size is None or checkpoint_size >= 1
+        self.case_id = case_id
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_size = checkpoint_size
+
+        self.deltas = []
+        self._dates = []
+        # parallel lists: _checkpoint_positions[i] is the number of deltas
+        # folded into _checkpoints[i]
+        self._checkpoint_positions = []
+        self._checkpoints = []
+        self._current = None
+        self._count_since_checkpoint = 0
+        self._size_since_checkpoint = 0
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def append(self, delta):
+        assert isinstance(delta, CaseDelta)
+        if delta.case_id != self.case_id:
+            raise CaseIdError()
+        if self._dates and delta.date_modified < self._dates[-1]:
+            raise CaseHistoryError(
+                'delta for case {} modified at {} is older than the latest '
+                'delta in its history ({})'.format(
+                    self.case_id, delta.date_modified, self._dates[-1]))
+
+        # keep our own copy so later changes by the caller can't leak in
+        delta = delta.copy()
+        if self._current is None:
+            self._current = delta.copy()
+        else:
+            # raises before anything is recorded if the delta can't apply
+            self._current += delta
+
+        self.deltas.append(delta)
+        self._dates.append(delta.date_modified)
+        self._count_since_checkpoint += 1
+        self._size_since_checkpoint += _delta_size(delta)
+
+        if (len(self.deltas) == 1
+                or self._count_since_checkpoint >= self.checkpoint_interval
+                or (self.checkpoint_size is not None and
+                    self._size_since_checkpoint >= self.checkpoint_size)):
+            self._checkpoint()
+
+    def _checkpoint(self):
+        self._checkpoint_positions.append(len(self.deltas))
+        self._checkpoints.append(self._current.copy())
+        self._count_since_checkpoint = 0
+        self._size_since_checkpoint = 0
+
+    @property
+    def current_state(self):
+        if self._current is None:
+            return None
+        return self._current.copy()
+
+    def state_at(self, date_modified):
+        """
+        Return the case as it was after applying every delta with
+        `date_modified` at or before the given datetime,
+        or None if the case did not exist yet.
+
+        """
+        position = bisect.bisect_right(self._dates, date_modified)
+        if position == 0:
+            return None
+        i = bisect.bisect_right(self._checkpoint_positions, position) - 1
+        checkpoint_position = self._checkpoint_positions[i]
+        state = self._checkpoints[i].copy()
+        for delta in self.deltas[checkpoint_position:position]:
+            state += delta
+        return state
+
+
+class CaseHistoryStore(object):
+    """
+    A CaseHistory per case_id, all sharing the same checkpoint spacing
+
+    """
+
+    def __init__(self, checkpoint_interval=50, checkpoint_size=None):
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_size = checkpoint_size
+        self._histories = {}
+
+    def __contains__(self, case_id):
+        return case_id in self._histories
+
+    def __getitem__(self, case_id):
+        return self._histories[case_id]
+
+    def add(self, delta):
+        try:
+            history = self._histories[delta.case_id]
+        except KeyError:
+            history = CaseHistory(
+                delta.case_id,
+                checkpoint_interval=self.checkpoint_interval,
+                checkpoint_size=self.checkpoint_size,
+            )
+        history.append(delta)
+        self._histories[delta.case_id] = history
+
+    def state_at(self, case_id, date_modified):
+        try:
+            history = self._histories[case_id]
+        except KeyError:
+            return None
+        return history.state_at(date_modified)
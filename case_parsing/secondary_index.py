@@ -0,0 +1,127 @@
+from .delta import CaseDelta
+from .exceptions import CloseCaseError, CreateCaseError
+
+_EMPTY = frozenset()
+
+
+class SecondaryIndex(object):
+    """
+    Open cases by owner_id, case_type and (opt-in) update properties
+
+    Only the indexed values of each open case are kept, and `apply`
+    merges a delta into them with the same precedence as CaseDelta `+=`,
+    reading only the fields the delta sets. A case is dropped from every
+    index when it closes; only its id is remembered, so that later deltas
+    for it raise CloseCaseError. `len` and `in` count open cases only.
+
+    """
+    INDEXED_PROPERTIES = ('owner_id', 'case_type')
+
+    def __init__(self, update_keys=()):
+        self.update_keys = frozenset(update_keys)
+        # each open case maps to a list of its values for _fields;
+        # _indexes[i] maps a value of _fields[i] to the ids having it
+        self._fields = (self.INDEXED_PROPERTIES +
+                        tuple(sorted(self.update_keys)))
+        self._update_positions = {
+            key: i for i, key in enumerate(self._fields)
+            if i >= len(self.INDEXED_PROPERTIES)
+        }
+        self._indexes = [{} for _ in self._fields]
+        self._cases = {}
+        self._closed = set()
+
+    def __contains__(self, case_id):
+        return case_id in self._cases
+
+    def __len__(self):
+        return len(self._cases)
+
+    def apply(self, delta):
+        assert isinstance(delta, CaseDelta)
+        case_id = delta.case_id
+        if case_id in self._closed:
+            raise CloseCaseError()
+        values = self._cases.get(case_id)
+        if values is not None and delta.create:
+            raise CreateCaseError()
+
+        if delta.close:
+            if values is not None:
+                for position, value in enumerate(values):
+                    if value is not None:
+                        self._discard(position, value, case_id)
+                del self._cases[case_id]
+            self._closed.add(case_id)
+            return
+
+        if values is None:
+            values = self._cases[case_id] = [None] * len(self._fields)
+
+        changes = [(position, getattr(delta, attr))
+                   for position, attr in enumerate(self.INDEXED_PROPERTIES)]
+        changes.extend((self._update_positions[key], value)
+                       for key, value in delta.update.items()
+                       if key in self._update_positions)
+        for position, value in changes:
+            old = values[position]
+            if value is None or value == old:
+                continue
+            if old is not None:
+                self._discard(position, old, case_id)
+            values[position] = value
+            try:
+                self._indexes[position][value].add(case_id)
+            except KeyError:
+                self._indexes[position][value] = {case_id}
+
+    def _discard(self, position, value, case_id):
+        index = self._indexes[position]
+        case_ids = index[value]
+        case_ids.discard(case_id)
+        if not case_ids:
+            del index[value]
+
+    def _property_index(self, attr):
+        return self._indexes[self.INDEXED_PROPERTIES.index(attr)]
+
+    def _update_index(self, key):
+        try:
+            return self._indexes[self._update_positions[key]]
+        except KeyError:
+            raise ValueError('update property {!r} is not indexed'.format(key))
+
+    def open_cases(self):
+        return set(self._cases)
+
+    def owned_by(self, owner_id):
+        return set(self._property_index('owner_id').get(owner_id, _EMPTY))
+
+    def of_type(self, case_type):
+        return set(self._property_index('case_type').get(case_type, _EMPTY))
+
+    def with_property(self, key, value):
+        return set(self._update_index(key).get(value, _EMPTY))
+
+    def find(self, owner_id=None, case_type=None, update=None):
+        """
+        Return the ids of open cases matching every criterion given,
+        intersecting the matching index entries smallest first
+
+        """
+        sets = []
+        for attr, value in (('owner_id', owner_id), ('case_type', case_type)):
+            if value is not None:
+                sets.append(self._property_index(attr).get(value, _EMPTY))
+        for key, value in (update or {}).items():
+            sets.append(self._update_index(key).get(value, _EMPTY))
+
+        if not sets:
+            return self.open_cases()
+        sets.sort(key=len)
+        result = set(sets[0])
+        for case_ids in sets[1:]:
+            if not result:
+                break
+            result.intersection_update(case_ids)
+        return result
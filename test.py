@@ -2,10 +2,17 @@ import datetime
 
 import unittest2
 
-from case_parsing.exceptions import CaseParsingException
+from case_parsing.exceptions import (
+    CaseParsingException,
+    CaseHistoryError,
+    CloseCaseError,
+    CreateCaseError,
+)
 import xml2json
 from case_parsing import parse_casexml_json, CASEXML_XMLNS, get_case_delta
 from case_parsing.delta import CaseDelta
+from case_parsing.history import CaseHistory, CaseHistoryStore
+from case_parsing.secondary_index import SecondaryIndex
 
 
 CASE_XML_1 = """
@@ -324,5 +331,240 @@ class CaseDeltaTest(unittest2.TestCase):
         )
 
 
+class CaseHistoryTest(unittest2.TestCase):
+    maxDiff = None
+
+    def _make_deltas(self, n):
+        start = datetime.datetime(2014, 1, 1)
+        deltas = [CaseDelta(
+            case_id='A',
+            create=True,
+            close=False,
+            date_modified=start,
+            date_opened=start,
+            case_type='test',
+            case_name='john',
+            owner_id='X',
+        )]
+        for i in range(1, n):
+            deltas.append(CaseDelta(
+                case_id='A',
+                create=False,
+                close=False,
+                date_modified=start + datetime.timedelta(days=i),
+                owner_id='Y' if i % 2 else 'X',
+                update={'visit_number': unicode(i), 'visit_%s' % i: 'yes'},
+            ))
+        return deltas
+
+    def _fold(self, deltas):
+        state = deltas[0]
+        for delta in deltas[1:]:
+            state = state + delta
+        return state
+
+    def _assert_matches_fold(self, history, deltas):
+        self.assertIsNone(
+            history.state_at(deltas[0].date_modified
+                             - datetime.timedelta(seconds=1)))
+        for i, delta in enumerate(deltas):
+            self.assertDictEqual(
+                history.state_at(delta.date_modified).to_json(),
+                self._fold(deltas[:i + 1]).to_json(),
+            )
+        self.assertDictEqual(
+            history.state_at(datetime.datetime.max).to_json(),
+            self._fold(deltas).to_json(),
+        )
+
+    def test_state_at(self):
+        deltas = self._make_deltas(12)
+        for interval in (1, 3, 5, 50):
+            history = CaseHistory('A', checkpoint_interval=interval)
+            for delta in deltas:
+                history.append(delta)
+            self._assert_matches_fold(history, deltas)
+
+    def test_checkpoint_interval(self):
+        history = CaseHistory('A', checkpoint_interval=5)
+        for delta in self._make_deltas(12):
+            history.append(delta)
+        self.assertEqual(history._checkpoint_positions, [1, 6, 11])
+
+    def test_checkpoint_size(self):
+        deltas = self._make_deltas(12)
+        history = CaseHistory('A', checkpoint_interval=50, checkpoint_size=5)
+        for delta in deltas:
+            history.append(delta)
+        # each update after the create carries two items
+        self.assertEqual(history._checkpoint_positions, [1, 4, 7, 10])
+        self._assert_matches_fold(history, deltas)
+
+    def test_state_at_does_not_mutate(self):
+        history = CaseHistory('A', checkpoint_interval=2)
+        deltas = self._make_deltas(4)
+        for delta in deltas:
+            history.append(delta)
+        history.state_at(deltas[1].date_modified).update['foo'] = 'bar'
+        self.assertNotIn('foo', history.state_at(deltas[1].date_modified).update)
+        self.assertNotIn('foo', history.current_state.update)
+        self._assert_matches_fold(history, deltas)
+
+    def test_append_copies(self):
+        deltas = self._make_deltas(4)
+        expected = self._fold(deltas).to_json()
+        history = CaseHistory('A', checkpoint_interval=2)
+        for delta in deltas:
+            history.append(delta)
+        for delta in deltas:
+            delta.update['foo'] = 'bar'
+        self.assertDictEqual(
+            history.state_at(datetime.datetime.max).to_json(), expected)
+
+    def test_out_of_order(self):
+        deltas = self._make_deltas(3)
+        history = CaseHistory('A')
+        history.append(deltas[0])
+        history.append(deltas[2])
+        with self.assertRaises(CaseHistoryError):
+            history.append(deltas[1])
+        self.assertEqual(len(history), 2)
+
+    def test_append_after_close(self):
+        deltas = self._make_deltas(3)
+        deltas[1].close = True
+        history = CaseHistory('A')
+        history.append(deltas[0])
+        history.append(deltas[1])
+        with self.assertRaises(CloseCaseError):
+            history.append(deltas[2])
+        self.assertEqual(len(history), 2)
+        self.assertTrue(history.current_state.close)
+
+    def test_store(self):
+        deltas = self._make_deltas(7)
+        other = CaseDelta(
+            case_id='B',
+            create=True,
+            close=False,
+            date_modified=datetime.datetime(2014, 1, 3),
+            case_type='test',
+        )
+        store = CaseHistoryStore(checkpoint_interval=2)
+        for delta in deltas[:3] + [other] + deltas[3:]:
+            store.add(delta)
+        self.assertEqual(len(store['A']), 7)
+        self.assertEqual(len(store['B']), 1)
+        self.assertEqual(store['A'].checkpoint_interval, 2)
+        self.assertIsNone(store.state_at('C', datetime.datetime.max))
+        self.assertIsNone(store.state_at('B', datetime.datetime(2014, 1, 2)))
+        self.assertDictEqual(
+            store.state_at('B', datetime.datetime(2014, 1, 3)).to_json(),
+            other.to_json(),
+        )
+        self.assertDictEqual(
+            store.state_at('A', datetime.datetime(2014, 1, 4, 12)).to_json(),
+            self._fold(deltas[:4]).to_json(),
+        )
+
+
+class SecondaryIndexTest(unittest2.TestCase):
+
+    def _create(self, case_id, owner_id, case_type='test', **update):
+        return CaseDelta(
+            case_id=case_id,
+            create=True,
+            close=False,
+            date_modified=datetime.datetime(2014, 1, 1),
+            case_type=case_type,
+            owner_id=owner_id,
+            update=update,
+        )
+
+    def _update(self, case_id, owner_id=None, close=False, **update):
+        return CaseDelta(
+            case_id=case_id,
+            create=False,
+            close=close,
+            date_modified=datetime.datetime(2014, 1, 2),
+            owner_id=owner_id,
+            update=update,
+        )
+
+    def _make_index(self):
+        index = SecondaryIndex(update_keys=['district'])
+        index.apply(self._create('A', 'X', district='north'))
+        index.apply(self._create('B', 'X', case_type='other',
+                                 district='south'))
+        index.apply(self._create('C', 'Y', district='north', age='7'))
+        return index
+
+    def test_lookups(self):
+        index = self._make_index()
+        self.assertEqual(index.open_cases(), {'A', 'B', 'C'})
+        self.assertEqual(index.owned_by('X'), {'A', 'B'})
+        self.assertEqual(index.owned_by('Z'), set())
+        self.assertEqual(index.of_type('test'), {'A', 'C'})
+        self.assertEqual(index.with_property('district', 'north'), {'A', 'C'})
+        with self.assertRaises(ValueError):
+            index.with_property('age', '7')
+
+    def test_find(self):
+        index = self._make_index()
+        self.assertEqual(index.find(), {'A', 'B', 'C'})
+        self.assertEqual(index.find(owner_id='X', case_type='test'), {'A'})
+        self.assertEqual(
+            index.find(case_type='test', update={'district': 'north'}),
+            {'A', 'C'})
+        self.assertEqual(
+            index.find(owner_id='Y', update={'district': 'south'}), set())
+        with self.assertRaises(ValueError):
+            index.find(owner_id='X', update={'age': '7'})
+
+    def test_results_are_copies(self):
+        index = self._make_index()
+        index.owned_by('X').add('Z')
+        index.find(owner_id='X').add('Z')
+        self.assertEqual(index.owned_by('X'), {'A', 'B'})
+
+    def test_change_owner(self):
+        index = self._make_index()
+        index.apply(self._update('A', owner_id='Y', district='south'))
+        self.assertEqual(index.owned_by('X'), {'B'})
+        self.assertEqual(index.owned_by('Y'), {'A', 'C'})
+        self.assertEqual(index.with_property('district', 'north'), {'C'})
+        self.assertEqual(index.with_property('district', 'south'),
+                         {'A', 'B'})
+        # fields the delta doesn't set are left alone
+        index.apply(self._update('A', age='8'))
+        self.assertEqual(index.owned_by('Y'), {'A', 'C'})
+        self.assertEqual(index.of_type('test'), {'A', 'C'})
+
+    def test_close(self):
+        index = self._make_index()
+        index.apply(self._update('A', close=True))
+        index.apply(self._update('B', owner_id='Y', close=True))
+        self.assertEqual(index.open_cases(), {'C'})
+        self.assertEqual(index.owned_by('X'), set())
+        self.assertEqual(index.owned_by('Y'), {'C'})
+        self.assertEqual(index.with_property('district', 'north'), {'C'})
+        self.assertEqual(index.with_property('district', 'south'), set())
+        self.assertNotIn('X', index._property_index('owner_id'))
+        self.assertNotIn('A', index)
+        self.assertEqual(len(index), 1)
+
+    def test_invalid_delta(self):
+        index = self._make_index()
+        with self.assertRaises(CreateCaseError):
+            index.apply(self._create('A', 'Y'))
+        index.apply(self._update('A', close=True))
+        with self.assertRaises(CloseCaseError):
+            index.apply(self._update('A', owner_id='Y'))
+        with self.assertRaises(CloseCaseError):
+            index.apply(self._update('A', close=True))
+        self.assertEqual(index.owned_by('X'), {'B'})
+        self.assertEqual(index.owned_by('Y'), {'C'})
+
+
 if __name__ == '__main__':
     unittest2.main()